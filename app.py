@@ -1,53 +1,167 @@
 import os
+import hashlib
+import shutil
+import tempfile
 import concurrent.futures
+import multiprocessing
+from concurrent.futures.process import BrokenProcessPool
 import streamlit as st
-from backend.ingestion import process_file
-from backend.classification import classify_document
-from backend.storage import save_result, load_history
+from backend.ingestion import merge_page_ranges, pdf_page_ranges, process_file
+from backend.classification import classify_documents_batch, document_fingerprint
+from backend.storage import save_result, load_history, migrate_legacy_history
+
+# 🔹 Default upper bound on concurrent classification requests
+#    (REGDOC_CONCURRENCY, adjustable in the sidebar). LLM calls are
+#    network-bound, so this can sit well above the CPU count;
+#    backend.llm_client separately caps the number of in-flight OpenRouter
+#    requests.
+MAX_PARALLEL_DOCS = int(os.environ.get("REGDOC_CONCURRENCY", 16))
+
+# 🔹 Uploads are copied to disk in chunks of this size before ingestion
+UPLOAD_SPOOL_CHUNK = 1 << 20  # 1 MiB
+
+# 🔹 PDF parsing and OCR are CPU-bound, so ingestion runs in worker processes
+#    (one pool per server, shared by all sessions). "spawn" avoids forking
+#    Streamlit's threads into the workers.
+@st.cache_resource
+def get_ingestion_pool():
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=os.cpu_count() or 1,
+        mp_context=multiprocessing.get_context("spawn"),
+    )
 
-# ----------------------------------------------------------------------
-# BASIC PAGE CONFIG
-# ----------------------------------------------------------------------
-st.set_page_config(page_title="RegDoc Classifier", layout="wide")
-
-# 🔹 Style tweaks for metrics
-st.markdown(
-    """
-    <style>
-    /* Metric value (the big number/text) */
-    div[data-testid="stMetricValue"] > div {
-        font-size: 22px;
-    }
-
-    /* Metric label ("AI Category", "Unsafe", etc.) */
-    div[data-testid="stMetricLabel"] > div {
-        font-size: 14px;
-    }
-    </style>
-    """,
-    unsafe_allow_html=True,
-)
-
-# 🔹 Session state for results so UI doesn't reset on interaction
-if "results" not in st.session_state:
-    st.session_state["results"] = []
 
 # 🔹 History path at project root (same file backend.storage writes to)
-HISTORY_PATH = os.path.join(os.path.dirname(__file__), "history.json")
+HISTORY_PATH = os.path.join(os.path.dirname(__file__), "history.jsonl")
+
+
+@st.cache_data(ttl=5, show_spinner=False)
+def load_history_df():
+    """Audit trail as a DataFrame, newest first (cached briefly across reruns)."""
+    import pandas as pd
+
+    migrate_legacy_history()
+    if not os.path.exists(HISTORY_PATH) or os.path.getsize(HISTORY_PATH) == 0:
+        return pd.DataFrame()
+    try:
+        df = pd.read_json(HISTORY_PATH, lines=True, convert_dates=False, dtype=False)
+    except ValueError:
+        # A corrupted line: fall back to the tolerant line-by-line loader
+        df = pd.DataFrame(load_history())
+    if "timestamp" in df.columns:
+        df = df.sort_values("timestamp", ascending=False)
+    return df
+
 
 # ----------------------------------------------------------------------
-# SIDEBAR NAVIGATION
+# PER-DOCUMENT RESULT VIEW
 # ----------------------------------------------------------------------
-st.sidebar.title("Navigation")
-page = st.sidebar.radio("Go to", ["Upload & Analyze", "History & Audit"])
+# A fragment: editing one document's override/comment widgets reruns only
+# this block, not every other result on the page.
+@st.fragment
+def render_result(item):
+    filename = item["filename"]
+    doc_info = item["doc_info"]
+    ai_result = item["ai_result"]
+
+    st.markdown("---")
+    st.subheader(f"{filename}")
+
+    # ------------------- METRICS -------------------
+    col_top1, col_top2, col_top3, col_top4, col_top5 = st.columns(5)
+    col_top1.metric("AI Category", ai_result.get("category", "—"))
+    col_top2.metric("Unsafe", "Yes" if ai_result.get("unsafe") else "No")
+    col_top3.metric("Kid-safe", "Yes" if ai_result.get("kid_safe") else "No")
+    col_top4.metric(
+        "Confidence",
+        f"{ai_result.get('confidence', 0.0) * 100:.0f}%"
+    )
+    col_top5.metric("Image Count", doc_info.get("num_images", 0))
+
+    # ------------------- AI REASONING -------------------
+    st.markdown("**AI Reasoning**")
+    st.write(ai_result.get("reasoning", "No reasoning provided."))
+
+    # ------------------- CITATIONS -------------------
+    citations = ai_result.get("citations") or []
+    if citations:
+        st.markdown("**Citations**")
+        st.table(citations)
+
+    # ------------------- DOCUMENT SUMMARY -------------------
+    pages = doc_info.get("pages", [])
+    with st.expander("Document summary", expanded=False):
+        if not pages:
+            st.write("No text was extracted from this document.")
+        else:
+            for p in pages:
+                page_num = p.get("page_num") or p.get("page") or "?"
+                text = (p.get("text") or "").strip()
+
+                st.markdown(f"**Page {page_num}**")
+
+                if not text:
+                    st.write("_No text on this page._")
+                    continue
+
+                # If text is short, just show it all
+                if len(text) <= 600:
+                    st.write(text)
+                else:
+                    # Show a preview + an expander for full text
+                    preview = text[:600] + "..."
+                    st.write(preview)
+
+                    with st.expander("Show full text"):
+                        st.write(text)
+
+    # ------------------- HUMAN REVIEW -------------------
+    st.markdown("### Human Review")
+
+    # Stable keys so Streamlit remembers the state
+    override_key = f"override_{filename}"
+    comment_key = f"comment_{filename}"
+
+    # (optional) initialize default override once
+    if override_key not in st.session_state:
+        st.session_state[override_key] = "No override"
+
+    override_choice = st.selectbox(
+        "Override AI category (optional)",
+        ["No override", "Public", "Confidential", "Highly Sensitive", "Unsafe"],
+        key=override_key,
+    )
+
+    reviewer_comment = st.text_area(
+        "Reviewer comment",
+        key=comment_key,
+        placeholder="Explain why you approved or changed the AI decision...",
+    )
+
+    if st.button("Save", key=f"save_{filename}"):
+        final_category = (
+            ai_result.get("category", "Public")
+            if override_choice == "No override"
+            else override_choice
+        )
+        try:
+            save_result(
+                filename=filename,
+                doc_info=doc_info,
+                ai_result=ai_result,
+                final_category=final_category,
+                reviewer_comment=reviewer_comment.strip(),
+            )
+            load_history_df.clear()
+            st.success(f"Review for '{filename}' saved to history.jsonl.")
+        except Exception as e:
+            st.error(f"Could not save review for {filename}: {e}")
 
-st.sidebar.markdown("---")
-st.sidebar.caption("Hitachi DS Datathon • AI-Powered Regulatory Classifier")
 
 # ----------------------------------------------------------------------
 # PAGE 1: Upload & Analyze (multi-file, parallel, with SUMMARY + HITL)
 # ----------------------------------------------------------------------
-if page == "Upload & Analyze":
+def render_upload_page(max_parallel_docs):
     st.title("Upload & Analyze Documents")
     st.caption(
         "Upload one or more documents. The app will classify them, show page-level summaries, "
@@ -71,38 +185,139 @@ if page == "Upload & Analyze":
         st.info(f"{len(uploaded_files)} file(s) selected.")
         progress = st.progress(0.0)
         status_placeholder = st.empty()
-        results = []
+        clf_cache = st.session_state["_clf_cache"]
+        results_by_hash = st.session_state["_results_by_hash"]
+
+        # UploadedFile is a BytesIO: getbuffer() is a zero-copy view of the
+        # upload, so hashing and spooling never duplicate its bytes in memory
+        def upload_digest(uploaded_file):
+            """BLAKE2b of an upload's bytes."""
+            if hasattr(uploaded_file, "getbuffer"):
+                with uploaded_file.getbuffer() as buf:
+                    return hashlib.blake2b(buf, digest_size=16).hexdigest()
+            digest = hashlib.blake2b(digest_size=16)
+            uploaded_file.seek(0)
+            for chunk in iter(lambda: uploaded_file.read(UPLOAD_SPOOL_CHUNK), b""):
+                digest.update(chunk)
+            uploaded_file.seek(0)
+            return digest.hexdigest()
+
+        def spool_to_disk(uploaded_file):
+            """Copy an upload to a temp file so ingestion works from disk, not RAM."""
+            suffix = os.path.splitext(uploaded_file.name)[1]
+            with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+                if hasattr(uploaded_file, "getbuffer"):
+                    with uploaded_file.getbuffer() as buf:
+                        tmp.write(buf)
+                else:
+                    shutil.copyfileobj(uploaded_file, tmp, length=UPLOAD_SPOOL_CHUNK)
+            return tmp.name
 
-        def process_single(uploaded_file):
-            """Ingest + classify a single file (used in threads)."""
-            doc_info = process_file(uploaded_file)
-            ai_result = classify_document(doc_info)
-            return {
-                "filename": uploaded_file.name,
-                "doc_info": doc_info,
-                "ai_result": ai_result,
-            }
-
-        total = len(uploaded_files)
-        done = 0
-
-        # Run all docs concurrently (good for I/O + network-bound LLM calls)
-        with concurrent.futures.ThreadPoolExecutor(
-            max_workers=min(4, total)
-        ) as executor:
-            future_to_file = {
-                executor.submit(process_single, f): f for f in uploaded_files
-            }
-            for future in concurrent.futures.as_completed(future_to_file):
-                f = future_to_file[future]
+        # Identical bytes (already analyzed this session, or uploaded twice
+        # now) are only ingested and classified once
+        digests = [(f, upload_digest(f)) for f in uploaded_files]
+        spooled = {}
+        try:
+            for f, digest in digests:
+                if digest not in results_by_hash and digest not in spooled:
+                    spooled[digest] = (f, spool_to_disk(f))
+
+            total = len(spooled)
+            done = 0
+
+            # Stage 1: ingest all new docs in parallel worker processes;
+            # long PDFs are split into page ranges so their pages are
+            # extracted in parallel too
+            ingested = []
+            if spooled:
+                pool = get_ingestion_pool()
+                future_to_file = {}
+                parts = {}
+                for digest, (f, path) in spooled.items():
+                    page_ranges = pdf_page_ranges(path, f.name)
+                    parts[digest] = (len(page_ranges), [])
+                    for page_range in page_ranges:
+                        future = pool.submit(process_file, path, f.name, page_range)
+                        future_to_file[future] = (f, digest)
+                failed = set()
+                for future in concurrent.futures.as_completed(future_to_file):
+                    f, digest = future_to_file[future]
+                    if digest in failed:
+                        continue
+                    try:
+                        expected, done_parts = parts[digest]
+                        done_parts.append(future.result())
+                        if len(done_parts) < expected:
+                            continue
+                        ingested.append(
+                            {
+                                "filename": f.name,
+                                "digest": digest,
+                                "doc_info": done_parts[0] if expected == 1 else merge_page_ranges(done_parts),
+                            }
+                        )
+                        done += 1
+                        progress.progress(done / (2 * total))
+                        status_placeholder.write(f"Extracted: {f.name}")
+                    except BrokenProcessPool as e:
+                        # A worker died; start a fresh pool on the next run
+                        failed.add(digest)
+                        get_ingestion_pool.clear()
+                        st.error(f"Error processing {f.name}: {e}")
+                    except Exception as e:
+                        failed.add(digest)
+                        st.error(f"Error processing {f.name}: {e}")
+        finally:
+            for _, path in spooled.values():
                 try:
-                    result = future.result()
-                    results.append(result)
-                    done += 1
-                    progress.progress(done / total)
-                    status_placeholder.write(f"Finished: {f.name}")
-                except Exception as e:
-                    st.error(f"Error processing {f.name}: {e}")
+                    os.remove(path)
+                except OSError:
+                    pass
+
+        # Stage 2: classify; uncached docs share LLM requests where possible
+        pending = []
+        for item in ingested:
+            item["cache_key"] = document_fingerprint(item["doc_info"])
+            item["ai_result"] = clf_cache.get(item["cache_key"])
+            if item["ai_result"] is None:
+                pending.append(item)
+
+        if pending:
+            status_placeholder.write(f"Classifying {len(pending)} document(s)...")
+            try:
+                ai_results = classify_documents_batch(
+                    [item["doc_info"] for item in pending],
+                    max_workers=max_parallel_docs,
+                )
+                for item, ai_result in zip(pending, ai_results):
+                    if isinstance(ai_result, Exception):
+                        st.error(f"Error classifying {item['filename']}: {ai_result}")
+                        continue
+                    item["ai_result"] = ai_result
+                    clf_cache[item["cache_key"]] = ai_result
+            except Exception as e:
+                st.error(f"Error classifying documents: {e}")
+        progress.progress(1.0)
+
+        for item in ingested:
+            if item["ai_result"] is not None:
+                results_by_hash[item["digest"]] = {
+                    "doc_info": item["doc_info"],
+                    "ai_result": item["ai_result"],
+                }
+
+        results = []
+        for f, digest in digests:
+            cached = results_by_hash.get(digest)
+            if cached is None:
+                continue
+            results.append(
+                {
+                    "filename": f.name,
+                    "doc_info": dict(cached["doc_info"], filename=f.name),
+                    "ai_result": cached["ai_result"],
+                }
+            )
 
         progress.empty()
         status_placeholder.empty()
@@ -114,142 +329,46 @@ if page == "Upload & Analyze":
     # 👇 ALWAYS render results if we have them in session_state
     if st.session_state["results"]:
         for item in st.session_state["results"]:
-            filename = item["filename"]
-            doc_info = item["doc_info"]
-            ai_result = item["ai_result"]
-
-            st.markdown("---")
-            st.subheader(f"{filename}")
-
-            # ------------------- METRICS -------------------
-            col_top1, col_top2, col_top3, col_top4, col_top5 = st.columns(5)
-            col_top1.metric("AI Category", ai_result.get("category", "—"))
-            col_top2.metric("Unsafe", "Yes" if ai_result.get("unsafe") else "No")
-            col_top3.metric("Kid-safe", "Yes" if ai_result.get("kid_safe") else "No")
-            col_top4.metric(
-                "Confidence",
-                f"{ai_result.get('confidence', 0.0) * 100:.0f}%"
-            )
-            col_top5.metric("Image Count", doc_info.get("num_images", 0))
-
-            # ------------------- AI REASONING -------------------
-            st.markdown("**AI Reasoning**")
-            st.write(ai_result.get("reasoning", "No reasoning provided."))
-
-            # ------------------- CITATIONS -------------------
-            citations = ai_result.get("citations") or []
-            if citations:
-                st.markdown("**Citations**")
-                st.table(citations)
-
-                        # ------------------- DOCUMENT SUMMARY -------------------
-            pages = doc_info.get("pages", [])
-            with st.expander("Document summary", expanded=False):
-                if not pages:
-                    st.write("No text was extracted from this document.")
-                else:
-                    for p in pages:
-                        page_num = p.get("page_num") or p.get("page") or "?"
-                        text = (p.get("text") or "").strip()
-
-                        st.markdown(f"**Page {page_num}**")
-
-                        if not text:
-                            st.write("_No text on this page._")
-                            continue
-
-                        # If text is short, just show it all
-                        if len(text) <= 600:
-                            st.write(text)
-                        else:
-                            # Show a preview + an expander for full text
-                            preview = text[:600] + "..."
-                            st.write(preview)
-
-                            with st.expander("Show full text"):
-                                st.write(text)
-
-            # ------------------- HUMAN REVIEW -------------------
-            st.markdown("### Human Review")
-
-            # Stable keys so Streamlit remembers the state
-            override_key = f"override_{filename}"
-            comment_key = f"comment_{filename}"
+            render_result(item)
 
-            # (optional) initialize default override once
-            if override_key not in st.session_state:
-                st.session_state[override_key] = "No override"
-
-            override_choice = st.selectbox(
-                "Override AI category (optional)",
-                ["No override", "Public", "Confidential", "Highly Sensitive", "Unsafe"],
-                key=override_key,
-            )
-
-            reviewer_comment = st.text_area(
-                "Reviewer comment",
-                key=comment_key,
-                placeholder="Explain why you approved or changed the AI decision...",
-            )
-
-            if st.button("Save", key=f"save_{filename}"):
-                final_category = (
-                    ai_result.get("category", "Public")
-                    if override_choice == "No override"
-                    else override_choice
-                )
-                try:
-                    save_result(
-                        filename=filename,
-                        doc_info=doc_info,
-                        ai_result=ai_result,
-                        final_category=final_category,
-                        reviewer_comment=reviewer_comment.strip(),
-                    )
-                    st.success(f"Review for '{filename}' saved to history.json.")
-                except Exception as e:
-                    st.error(f"Could not save review for {filename}: {e}")
-
-        # Optional: button to clear current session results (not history.json)
+        # Optional: button to clear current session results (not history.jsonl)
         if st.button("Clear current results"):
             st.session_state["results"] = []
             st.rerun()
 
+
 # ----------------------------------------------------------------------
 # PAGE 2: History & Audit
 # ----------------------------------------------------------------------
-elif page == "History & Audit":
+def render_history_page():
     st.title("History & Audit Trail")
 
-    history = load_history()
+    history_df = load_history_df()
 
     # Simple clear-history button (no dropdown/expander)
     st.markdown("#### Clear audit history")
     st.caption(
         "This will permanently delete all entries from the audit trail "
-        "(history.json in the project root) and cannot be undone."
+        "(history.jsonl in the project root) and cannot be undone."
     )
     if st.button("Clear ALL history"):
         try:
             if os.path.exists(HISTORY_PATH):
                 os.remove(HISTORY_PATH)
+            load_history_df.clear()
             st.success("Audit history cleared.")
             st.rerun()
         except Exception as e:
             st.error(f"Could not clear history: {e}")
 
-    if not history:
+    if history_df.empty:
         st.info(
             "No documents processed yet. Go to 'Upload & Analyze', run a document, "
             "and click 'Save Review'."
         )
     else:
-        import pandas as pd
-
-        df = pd.DataFrame(history)
-
         st.subheader("Processed Documents")
-        df_sorted = df.sort_values("timestamp", ascending=False)
+        df_sorted = history_df
 
         # only show columns that actually exist in the history file
         show_cols = [
@@ -288,3 +407,66 @@ elif page == "History & Audit":
                 st.write(f"**Confidence:** {conf_val}")
         st.write(f"**Reviewer comment:** {latest.get('reviewer_comment') or '—'}")
         st.write(f"**Timestamp (UTC):** {latest.get('timestamp')}")
+
+
+def main():
+    # ----------------------------------------------------------------------
+    # BASIC PAGE CONFIG
+    # ----------------------------------------------------------------------
+    st.set_page_config(page_title="RegDoc Classifier", layout="wide")
+
+    # 🔹 Style tweaks for metrics
+    st.markdown(
+        """
+        <style>
+        /* Metric value (the big number/text) */
+        div[data-testid="stMetricValue"] > div {
+            font-size: 22px;
+        }
+
+        /* Metric label ("AI Category", "Unsafe", etc.) */
+        div[data-testid="stMetricLabel"] > div {
+            font-size: 14px;
+        }
+        </style>
+        """,
+        unsafe_allow_html=True,
+    )
+
+    # 🔹 Session state for results so UI doesn't reset on interaction
+    if "results" not in st.session_state:
+        st.session_state["results"] = []
+
+    # 🔹 Classification results keyed by document content hash, so re-running the
+    #    same documents in this session doesn't call the LLM again
+    if "_clf_cache" not in st.session_state:
+        st.session_state["_clf_cache"] = {}
+
+    # 🔹 Ingested + classified results keyed by a hash of the uploaded bytes, so
+    #    identical uploads skip ingestion as well
+    if "_results_by_hash" not in st.session_state:
+        st.session_state["_results_by_hash"] = {}
+
+    # ----------------------------------------------------------------------
+    # SIDEBAR NAVIGATION
+    # ----------------------------------------------------------------------
+    st.sidebar.title("Navigation")
+    page = st.sidebar.radio("Go to", ["Upload & Analyze", "History & Audit"])
+
+    max_parallel_docs = st.sidebar.slider(
+        "Max parallel docs", 1, 32, max(1, min(MAX_PARALLEL_DOCS, 32)), key="_concurrency"
+    )
+
+    st.sidebar.markdown("---")
+    st.sidebar.caption("Hitachi DS Datathon • AI-Powered Regulatory Classifier")
+
+    if page == "Upload & Analyze":
+        render_upload_page(max_parallel_docs)
+    elif page == "History & Audit":
+        render_history_page()
+
+
+# Streamlit runs this script as __main__; the "spawn" ingestion workers
+# re-import it as __mp_main__ and must not render the page themselves.
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,29 @@
-import json
+import hashlib
+import logging
 import os
 import re
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from functools import lru_cache
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple, Union
 
-from .pii_detection import find_pii
-from .safety import naive_unsafe_check, profanity_pages, sensitive_equipment_pages
+import orjson
+
+try:
+    import tiktoken
+
+    _TOKEN_ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    # tiktoken is optional (and fetches its encoding on first use); fall back
+    # to a character-based estimate
+    _TOKEN_ENCODING = None
+
+from .scan import scan_documents, scan_pages
+from .safety import sensitive_equipment_pages
 from .llm_client import call_openrouter_chat
 
+logger = logging.getLogger(__name__)
+
 # === Prompt library paths ===
 PROMPTS_DIR = os.path.join(os.path.dirname(__file__), "prompts")
 PROMPT_CONFIG_PATH = os.path.join(PROMPTS_DIR, "prompt_config.json")
@@ -16,31 +32,54 @@ PRIMARY_MODEL = "meta-llama/llama-3.1-8b-instruct"
 VALIDATOR_MODEL = "meta-llama/llama-3.1-70b-instruct"
 VALIDATION_THRESHOLD = 0.6
 
+# Page summaries sent to the LLM: a budget for the whole document, shared out
+# by how much each page triggered the heuristics, and a cap per page
+SUMMARY_TOKEN_BUDGET = 6000
+PAGE_SUMMARY_MAX_TOKENS = 200
+CHARS_PER_TOKEN = 4  # estimate used when tiktoken isn't available
+
+# Multi-document requests: appended to the system prompt, capped per request
+BATCH_PROMPT_FILE = "batch.txt"
+BATCH_MAX_DOCS = 8
+BATCH_MAX_PROMPT_CHARS = 32000
+BATCH_MAX_WORKERS = 4
+
+# Opt-in: skip the LLM when deterministic rules already fix the outcome
+RULES_FASTPATH = os.getenv("REGDOC_RULES_FASTPATH") == "1"
+RULES_FASTPATH_CONFIDENCE = 0.95
+
 
 @lru_cache(maxsize=1)
 def load_prompt_config() -> Dict[str, Any]:
     try:
-        with open(PROMPT_CONFIG_PATH, "r", encoding="utf-8") as f:
-            return json.load(f)
+        with open(PROMPT_CONFIG_PATH, "rb") as f:
+            return orjson.loads(f.read())
     except FileNotFoundError:
         return {"default": ["base_classification.txt"]}
 
 
+@lru_cache(maxsize=32)
 def load_prompt_template(filename: str) -> str:
     path = os.path.join(PROMPTS_DIR, filename)
     with open(path, "r", encoding="utf-8") as f:
         return f.read()
 
 
-def build_system_prompt(context_flags: Dict[str, bool]) -> str:
-    cfg = load_prompt_config()
+def select_prompt_key(context_flags: Dict[str, bool]) -> str:
     if context_flags.get("unsafe_keyword_flag"):
-        key = "unsafe"
-    elif context_flags.get("has_ssn") or context_flags.get("has_pii"):
-        key = "sensitive"
-    else:
-        key = "public"
+        return "unsafe"
+    if context_flags.get("has_ssn") or context_flags.get("has_pii"):
+        return "sensitive"
+    return "public"
 
+
+def build_system_prompt(context_flags: Dict[str, bool]) -> str:
+    return build_system_prompt_for_key(select_prompt_key(context_flags))
+
+
+@lru_cache(maxsize=8)
+def build_system_prompt_for_key(key: str) -> str:
+    cfg = load_prompt_config()
     template_list = cfg.get(key, cfg.get("default", ["base_classification.txt"]))
     pieces: List[str] = []
     for fname in template_list:
@@ -53,18 +92,83 @@ def build_system_prompt(context_flags: Dict[str, bool]) -> str:
     return "\n\n".join(pieces)
 
 
-def run_llm_classification(payload: Dict[str, Any], model: str, system_prompt: str) -> Dict[str, Any]:
-    user_prompt = json.dumps(payload, ensure_ascii=False)
-    print(f"[LLM] Calling OpenRouter model={model}")
+def encode_user_prompt(payload: Dict[str, Any]) -> str:
+    return orjson.dumps(payload).decode("utf-8")
+
+
+def run_llm_classification(user_prompt: str, model: str, system_prompt: str) -> Dict[str, Any]:
+    """Classify one document; ``user_prompt`` is its payload from encode_user_prompt."""
+    logger.debug("Calling OpenRouter model=%s", model)
 
     llm_raw = call_openrouter_chat(
         model=model,
         system_prompt=system_prompt,
         user_prompt=user_prompt,
         response_format_json=True,
-        temperature=0.1,
+        temperature=0.0,
+    )
+    return normalize_llm_result(llm_raw)
+
+
+def run_llm_batch_classification(
+    user_prompts: List[str], model: str, system_prompt: str
+) -> Optional[List[Dict[str, Any]]]:
+    """Classify several documents in one request.
+
+    Returns one normalized result per prompt, in input order, or None if the
+    model's answer can't be lined up with the inputs.
+    """
+    # Each prompt is already a JSON object; splice them instead of re-encoding
+    user_prompt = '{"documents":[' + ",".join(user_prompts) + "]}"
+    logger.debug("Calling OpenRouter model=%s (batch of %d)", model, len(user_prompts))
+
+    llm_raw = call_openrouter_chat(
+        model=model,
+        system_prompt=f"{system_prompt}\n\n{load_prompt_template(BATCH_PROMPT_FILE)}",
+        user_prompt=user_prompt,
+        response_format_json=True,
+        temperature=0.0,
     )
 
+    items = llm_raw.get("results") if isinstance(llm_raw, dict) else None
+    if not isinstance(items, list) or len(items) != len(user_prompts):
+        return None
+    if not all(isinstance(item, dict) for item in items):
+        return None
+    return [normalize_llm_result(item) for item in items]
+
+
+def run_llm_classifications(
+    user_prompts: List[str], model: str, system_prompt: str
+) -> List[Union[Dict[str, Any], Exception]]:
+    """Batch when there's more than one prompt; per-document calls otherwise or on a failed batch.
+
+    Never raises: a document whose call fails gets the exception in its
+    slot, so one bad document doesn't take the others down with it.
+    """
+    if len(user_prompts) > 1:
+        try:
+            batched = run_llm_batch_classification(user_prompts, model, system_prompt)
+        except Exception as e:
+            # HTTP error, invalid JSON, ...: retry the documents one by one
+            logger.warning("Batch request to %s failed (%s); falling back to per-document calls.", model, e)
+            batched = None
+        else:
+            if batched is None:
+                logger.warning("Batch reply from %s did not match inputs; falling back to per-document calls.", model)
+        if batched is not None:
+            return batched
+
+    results: List[Union[Dict[str, Any], Exception]] = []
+    for p in user_prompts:
+        try:
+            results.append(run_llm_classification(p, model, system_prompt))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def normalize_llm_result(llm_raw: Dict[str, Any]) -> Dict[str, Any]:
     category = llm_raw.get("category", "Public")
     unsafe = bool(llm_raw.get("unsafe", False))
     kid_safe = bool(llm_raw.get("kid_safe", not unsafe))
@@ -86,6 +190,21 @@ def run_llm_classification(payload: Dict[str, Any], model: str, system_prompt: s
     }
 
 
+def rules_fastpath_result(unsafe_flag_heuristic: bool) -> Dict[str, Any]:
+    """Deterministic stand-in for the primary LLM result when an SSN decides the category."""
+    return {
+        "category": "Highly Sensitive and Unsafe" if unsafe_flag_heuristic else "Highly Sensitive",
+        "unsafe": unsafe_flag_heuristic,
+        "kid_safe": not unsafe_flag_heuristic,
+        "confidence": RULES_FASTPATH_CONFIDENCE,
+        "reasoning": (
+            "Rules fast path: Social Security Number detected and no other policy signals present; "
+            "classified as Highly Sensitive without an LLM call."
+        ),
+        "citations": [],
+    }
+
+
 # ---------------------------------------------------------------------------
 # Helper: detect internal/template/equipment keywords (policy rules)
 # ---------------------------------------------------------------------------
@@ -98,71 +217,311 @@ def detect_policy_keywords(text: str) -> Dict[str, bool]:
     }
 
 
+# ---------------------------------------------------------------------------
+# Helper: token-budgeted page summaries
+# ---------------------------------------------------------------------------
+@dataclass(slots=True, frozen=True)
+class PageSummary:
+    """One entry of the LLM payload's page_summaries (orjson encodes it as an object)."""
+
+    page: int
+    text: str
+
+
+def truncate_to_tokens(text: str, budget: int) -> str:
+    if _TOKEN_ENCODING is not None:
+        tokens = _TOKEN_ENCODING.encode(text)
+        if len(tokens) <= budget:
+            return text
+        return _TOKEN_ENCODING.decode(tokens[:budget]) + "..."
+    limit = budget * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    return text[:limit] + "..."
+
+
+def build_page_summaries(
+    pages: List[Dict[str, Any]], pii: List[Dict[str, Any]], prof_pages: List[int]
+) -> List[PageSummary]:
+    """Summaries for non-empty pages within SUMMARY_TOKEN_BUDGET.
+
+    Each page's share of the budget is proportional to 1 + its PII findings
+    (+1 for profanity), so flagged pages keep more text on long documents.
+    """
+    nonempty = [(p["page_num"], (p.get("text") or "").strip()) for p in pages]
+    nonempty = [(num, text) for num, text in nonempty if text]
+    if not nonempty:
+        return []
+
+    hits: Dict[int, int] = {}
+    for f in pii:
+        hits[f["page"]] = hits.get(f["page"], 0) + 1
+    for pnum in prof_pages:
+        hits[pnum] = hits.get(pnum, 0) + 1
+
+    weights = [1 + hits.get(num, 0) for num, _ in nonempty]
+    total_weight = sum(weights)
+
+    page_summaries: List[PageSummary] = []
+    for (num, text), weight in zip(nonempty, weights):
+        budget = min(PAGE_SUMMARY_MAX_TOKENS, SUMMARY_TOKEN_BUDGET * weight // total_weight)
+        if budget <= 0:
+            continue
+        page_summaries.append(PageSummary(num, truncate_to_tokens(text, budget)))
+    return page_summaries
+
+
+# ---------------------------------------------------------------------------
+# Helper: stable cache key for a document's extracted content
+# ---------------------------------------------------------------------------
+def document_fingerprint(doc_info: Dict[str, Any]) -> str:
+    """SHA-256 over everything classify_document reads from doc_info."""
+    key_parts = {
+        "num_pages": doc_info.get("num_pages"),
+        "num_images": doc_info.get("num_images"),
+        "pages": [(p.get("page_num"), p.get("text") or "") for p in doc_info.get("pages", [])],
+    }
+    return hashlib.sha256(orjson.dumps(key_parts, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
 # ---------------------------------------------------------------------------
 # Main classification orchestrator
 # ---------------------------------------------------------------------------
-def classify_document(doc_info: Dict[str, Any]) -> Dict[str, Any]:
+def prepare_document(
+    doc_info: Dict[str, Any],
+    scan: Optional[Tuple[List[Dict[str, Any]], bool, List[int]]] = None,
+) -> Dict[str, Any]:
+    """Run heuristics and build the LLM inputs for one document.
+
+    ``scan`` is this document's scan_pages result when it was already
+    computed (classify_documents_batch scans all documents together).
+    """
     pages = doc_info["pages"]
     num_pages = doc_info["num_pages"]
     num_images = doc_info["num_images"]
 
     # === Heuristic extraction ===
-    pii_raw = find_pii(pages)
+    pii_raw, unsafe_flag_heuristic, prof_pages = scan if scan is not None else scan_pages(pages)
     pii = [f for f in pii_raw if not (f.get("type") == "email" and f.get("is_business"))]
 
-    unsafe_flag_heuristic = naive_unsafe_check(pages)
-    prof_pages = profanity_pages(pages)
     has_ssn = any(f["type"] == "ssn" for f in pii)
     has_pii = bool(pii)
     equipment_pages = sensitive_equipment_pages(pages)
     has_sensitive_equipment = bool(equipment_pages) and num_images > 0
 
+    # === Policy keyword detection (TC3–TC5) ===
+    full_text = " ".join(p.get("text", "") for p in pages)
+    policies = detect_policy_keywords(full_text)
+
+    # An SSN forces "Highly Sensitive" below; if no policy rule can change that,
+    # the LLM call adds nothing to the outcome.
+    rules_decided = (
+        RULES_FASTPATH and has_ssn and not has_sensitive_equipment and not any(policies.values())
+    )
+
+    ctx: Dict[str, Any] = {
+        "pii_raw": pii_raw,
+        "pii": pii,
+        "unsafe_flag_heuristic": unsafe_flag_heuristic,
+        "prof_pages": prof_pages,
+        "has_ssn": has_ssn,
+        "has_sensitive_equipment": has_sensitive_equipment,
+        "policies": policies,
+        "text_lower": full_text.lower(),
+        "rules_decided": rules_decided,
+    }
+    if rules_decided:
+        return ctx
+
     # === Dynamic system prompt ===
     context_flags = {
         "unsafe_keyword_flag": unsafe_flag_heuristic,
         "has_ssn": has_ssn,
         "has_pii": has_pii,
     }
-    system_prompt = build_system_prompt(context_flags)
 
     # === Summaries ===
-    page_summaries: List[Dict[str, Any]] = []
-    for p in pages:
-        text = (p.get("text") or "").strip()
-        if len(text) > 800:
-            text = text[:800] + "..."
-        page_summaries.append({"page": p["page_num"], "text": text})
-
-    user_payload = {
+    page_summaries = build_page_summaries(pages, pii, prof_pages)
+
+    ctx["prompt_key"] = select_prompt_key(context_flags)
+    # Encoded once; the primary, validator and batch requests all reuse it
+    ctx["user_prompt"] = encode_user_prompt({
         "num_pages": num_pages,
         "num_images": num_images,
         "pii_findings": pii,
         "unsafe_keyword_flag": unsafe_flag_heuristic,
         "profanity_pages": prof_pages,
         "page_summaries": page_summaries,
-    }
+    })
+    # When heuristics already flag risky content the primary model is usually
+    # unsure, so start the validator alongside it instead of after it.
+    ctx["likely_needs_validator"] = unsafe_flag_heuristic or has_ssn or has_pii
+    return ctx
 
-    # === 1) Primary LLM ===
-    primary = run_llm_classification(user_payload, PRIMARY_MODEL, system_prompt)
 
-    # === 2) Optional validator ===
-    validator: Optional[Dict[str, Any]] = None
-    if primary["confidence"] < VALIDATION_THRESHOLD:
-        validator = run_llm_classification(user_payload, VALIDATOR_MODEL, system_prompt)
+def classify_document(doc_info: Dict[str, Any]) -> Dict[str, Any]:
+    """Classify one document; raises if its LLM calls fail."""
+    result = classify_documents_batch([doc_info])[0]
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def _batch_chunks(indices: List[int], ctxs: List[Dict[str, Any]]) -> List[List[int]]:
+    """Split documents into request-sized groups by count and prompt size."""
+    chunks: List[List[int]] = []
+    current: List[int] = []
+    current_chars = 0
+    for i in indices:
+        chars = len(ctxs[i]["user_prompt"])
+        if current and (len(current) >= BATCH_MAX_DOCS or current_chars + chars > BATCH_MAX_PROMPT_CHARS):
+            chunks.append(current)
+            current, current_chars = [], 0
+        current.append(i)
+        current_chars += chars
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+# Per document: (primary, validator) results, or the exception that stopped it
+ChunkOutcome = Union[Tuple[Dict[str, Any], Optional[Dict[str, Any]]], Exception]
+
+
+def _classify_chunk(
+    prompt_key: str, user_prompts: List[str], speculate: List[bool]
+) -> List[ChunkOutcome]:
+    """Primary (and, at low confidence, validator) results for one request group.
+
+    Documents flagged in ``speculate`` are sent to the validator alongside
+    the primary so the two latencies overlap; those validator results are
+    discarded where the primary turns out confident.
+    """
+    system_prompt = build_system_prompt_for_key(prompt_key)
+    speculative = [i for i, flag in enumerate(speculate) if flag]
+
+    validators: List[Union[Dict[str, Any], Exception, None]] = [None] * len(user_prompts)
+    executor = ThreadPoolExecutor(max_workers=1) if speculative else None
+    try:
+        speculative_future = executor.submit(
+            run_llm_classifications, [user_prompts[i] for i in speculative], VALIDATOR_MODEL, system_prompt
+        ) if executor else None
+        primaries = run_llm_classifications(user_prompts, PRIMARY_MODEL, system_prompt)
+
+        low = [
+            i for i, p in enumerate(primaries)
+            if not isinstance(p, Exception) and p["confidence"] < VALIDATION_THRESHOLD
+        ]
+        if speculative_future is not None and any(speculate[i] for i in low):
+            for i, result in zip(speculative, speculative_future.result()):
+                if i in low:
+                    validators[i] = result
+        rest = [i for i in low if not speculate[i]]
+        if rest:
+            checked = run_llm_classifications([user_prompts[i] for i in rest], VALIDATOR_MODEL, system_prompt)
+            for i, result in zip(rest, checked):
+                validators[i] = result
+    finally:
+        if executor is not None:
+            # Don't block on a speculative validator we no longer need
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    outcomes: List[ChunkOutcome] = []
+    for primary, validator in zip(primaries, validators):
+        if isinstance(primary, Exception):
+            outcomes.append(primary)
+        elif isinstance(validator, Exception):
+            outcomes.append(validator)
+        else:
+            outcomes.append((primary, validator))
+    return outcomes
+
+
+def classify_documents_batch(
+    doc_infos: List[Dict[str, Any]], max_workers: int = BATCH_MAX_WORKERS
+) -> List[Union[Dict[str, Any], Exception]]:
+    """Classify several documents, sharing LLM requests between them.
+
+    Documents that use the same system prompt are sent together (up to
+    BATCH_MAX_DOCS per request); low-confidence ones then go to the validator
+    the same way, started alongside the primary for documents whose
+    heuristics already flag risk (likely_needs_validator). Results come back
+    in input order. A document that couldn't be classified gets the
+    exception instead of a result; the others are unaffected.
+    """
+    scans = scan_documents([d["pages"] for d in doc_infos])
+    ctxs = [prepare_document(d, scan) for d, scan in zip(doc_infos, scans)]
+    outcomes: List[Optional[ChunkOutcome]] = [None] * len(ctxs)
+
+    by_key: Dict[str, List[int]] = {}
+    for i, ctx in enumerate(ctxs):
+        if ctx["rules_decided"]:
+            outcomes[i] = (rules_fastpath_result(ctx["unsafe_flag_heuristic"]), None)
+        else:
+            by_key.setdefault(ctx["prompt_key"], []).append(i)
+
+    jobs = [(key, chunk) for key, indices in by_key.items() for chunk in _batch_chunks(indices, ctxs)]
+    if jobs:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(jobs)))) as executor:
+            futures = [
+                (chunk, executor.submit(
+                    _classify_chunk,
+                    key,
+                    [ctxs[i]["user_prompt"] for i in chunk],
+                    [ctxs[i]["likely_needs_validator"] for i in chunk],
+                ))
+                for key, chunk in jobs
+            ]
+            for chunk, future in futures:
+                try:
+                    chunk_outcomes = future.result()
+                except Exception as e:
+                    chunk_outcomes = [e] * len(chunk)
+                for i, outcome in zip(chunk, chunk_outcomes):
+                    outcomes[i] = outcome
+
+    return [
+        outcome if isinstance(outcome, Exception) else finalize_document(ctx, *outcome)
+        for ctx, outcome in zip(ctxs, outcomes)
+    ]
+
+
+def finalize_document(
+    ctx: Dict[str, Any], primary: Dict[str, Any], validator: Optional[Dict[str, Any]]
+) -> Dict[str, Any]:
+    """Merge model output with the deterministic / policy rules."""
+    pii_raw = ctx["pii_raw"]
+    pii = ctx["pii"]
+    unsafe_flag_heuristic = ctx["unsafe_flag_heuristic"]
+    prof_pages = ctx["prof_pages"]
+    has_ssn = ctx["has_ssn"]
+    has_sensitive_equipment = ctx["has_sensitive_equipment"]
+    policies = ctx["policies"]
+    text_lower = ctx["text_lower"]
 
     category = primary["category"]
     unsafe_flag_llm = primary["unsafe"]
     kid_safe = primary["kid_safe"]
     confidence = primary["confidence"]
     reasoning = primary["reasoning"]
-    citations: List[Dict[str, Any]] = list(primary["citations"] or [])
+    # Citations keyed on (page, reason): the same finding reported by both
+    # models or by a rule and a model is listed once, first occurrence wins
+    cite_map: Dict[Tuple[str, str], Any] = {}
+
+    def add_citation(c: Any) -> None:
+        # str() keeps the key hashable whatever types the model put in
+        key = (str(c.get("page")), str(c.get("reason"))) if isinstance(c, dict) else ("", repr(c))
+        cite_map.setdefault(key, c)
+
+    for c in primary["citations"] or []:
+        add_citation(c)
 
     if validator is not None:
         disagreement = (
             validator["category"] != primary["category"] or validator["unsafe"] != primary["unsafe"]
         )
         if disagreement:
-            print("[Validator] 70B disagreed with 8B.")
+            logger.info("Validator %s disagreed with %s.", VALIDATOR_MODEL, PRIMARY_MODEL)
             category = validator["category"]
             unsafe_flag_llm = validator["unsafe"]
             kid_safe = validator["kid_safe"]
@@ -174,7 +533,8 @@ def classify_document(doc_info: Dict[str, Any]) -> Dict[str, Any]:
                 f"Primary reasoning: {primary['reasoning']}\n\n"
                 f"Validator reasoning: {validator['reasoning']}"
             )
-            citations += (validator.get("citations") or [])
+            for c in validator.get("citations") or []:
+                add_citation(c)
 
         # === Merge with deterministic / policy rules ===
     unsafe_flag = unsafe_flag_llm or unsafe_flag_heuristic
@@ -188,11 +548,6 @@ def classify_document(doc_info: Dict[str, Any]) -> Dict[str, Any]:
         category = "Highly Sensitive" if "Unsafe" not in category else "Highly Sensitive and Unsafe"
         confidence = max(confidence, 0.9)
 
-    # === Policy keyword detection (TC3–TC5) ===
-    full_text = " ".join(p.get("text", "") for p in pages)
-    policies = detect_policy_keywords(full_text)
-    text_lower = full_text.lower()
-
     # --- marketing/public-safe guard ---
     is_marketing_or_public = any(
         kw in text_lower
@@ -210,7 +565,7 @@ def classify_document(doc_info: Dict[str, Any]) -> Dict[str, Any]:
             "\nPolicy rule: Detected internal or restricted-use document "
             "(e.g., memo/proposal). Classified as Confidential."
         )
-        citations.append({"page": 1, "reason": "Detected internal or restricted-use wording"})
+        add_citation({"page": 1, "reason": "Detected internal or restricted-use wording"})
 
     # --- 2️⃣ Equipment (TC4) ---
     elif (has_sensitive_equipment or policies["equipment"]) and not is_marketing_or_public:
@@ -220,7 +575,7 @@ def classify_document(doc_info: Dict[str, Any]) -> Dict[str, Any]:
             "\nPolicy rule: Contains identifiable aircraft or sensitive equipment serials. "
             "Classified as Confidential even if text appears public."
         )
-        citations.append({"page": 1, "reason": "Detected aircraft/serial references"})
+        add_citation({"page": 1, "reason": "Detected aircraft/serial references"})
 
     # --- 3️⃣ Template / shared editable (TC5) ---
     elif policies["template"] and not is_marketing_or_public:
@@ -231,7 +586,7 @@ def classify_document(doc_info: Dict[str, Any]) -> Dict[str, Any]:
                 "\nPolicy rule: Editable or shared operational template detected; "
                 "classified as Confidential due to potential misuse."
             )
-            citations.append({"page": 1, "reason": "Detected shared editable operational template"})
+            add_citation({"page": 1, "reason": "Detected shared editable operational template"})
 
     # --- Equipment fallback from safety module
     elif has_sensitive_equipment:
@@ -245,9 +600,10 @@ def classify_document(doc_info: Dict[str, Any]) -> Dict[str, Any]:
 
     # 4. Add PII / profanity citations
     for f in pii:
-        citations.append({"page": f["page"], "reason": f"Detected {f['type'].upper()}: {f['value']}"})
+        add_citation({"page": f["page"], "reason": f"Detected {f['type'].upper()}: {f['value']}"})
     for pnum in prof_pages:
-        citations.append({"page": pnum, "reason": "Strong profanity detected (not kid-safe)."})
+        add_citation({"page": pnum, "reason": "Strong profanity detected (not kid-safe)."})
+    citations = list(cite_map.values())
 
 
     # === Kid-safe normalization ===
@@ -1,34 +1,323 @@
 # backend/ingestion.py
-import io
+import hashlib
+import mmap
 import os
-from typing import Dict, Any, List
+from functools import lru_cache
+from typing import TYPE_CHECKING, Callable, Dict, Any, List, Optional, Tuple
 import shutil
-import pdfplumber
-from PIL import Image
-import pytesseract
+import tempfile
+import threading
+import time
+import orjson
+
+# PyMuPDF, Pillow, pytesseract and tesserocr are imported where they are
+# used, so each process loads only what it needs: the Streamlit process
+# opens PDFs with PyMuPDF (pdf_page_ranges counts pages and checks the text
+# layer) but never OCRs, and workers load the OCR stack only for images and
+# scanned PDF pages.
+if TYPE_CHECKING:
+    import pymupdf
+    from PIL import Image
 
 # ---------- TESSERACT SETUP (Windows-friendly) ----------
 
-# Try to find tesseract.exe automatically
-_tess_cmd = shutil.which("tesseract")
+@lru_cache(maxsize=1)
+def _pytesseract():
+    """pytesseract, pointed at the Tesseract binary on first use."""
+    import pytesseract
 
-if _tess_cmd is None:
-    # Common Windows install locations
-    candidate_paths = [
-        r"C:\Program Files\Tesseract-OCR\tesseract.exe",
-        r"C:\Program Files (x86)\Tesseract-OCR\tesseract.exe",
-    ]
-    for path in candidate_paths:
-        if os.path.exists(path):
-            _tess_cmd = path
+    # Try to find tesseract.exe automatically
+    tess_cmd = shutil.which("tesseract")
+
+    if tess_cmd is None:
+        # Common Windows install locations
+        candidate_paths = [
+            r"C:\Program Files\Tesseract-OCR\tesseract.exe",
+            r"C:\Program Files (x86)\Tesseract-OCR\tesseract.exe",
+        ]
+        for path in candidate_paths:
+            if os.path.exists(path):
+                tess_cmd = path
+                break
+
+    if tess_cmd:
+        pytesseract.pytesseract.tesseract_cmd = tess_cmd
+        print(f"[OCR] Using Tesseract at: {tess_cmd}")
+    else:
+        # We won't crash here; OCR calls will raise on the missing binary
+        print("[OCR] WARNING: tesseract.exe not found. Image OCR will be unavailable.")
+    return pytesseract
+
+
+# One engine per ingestion worker, created on first use; tesserocr APIs are
+# not thread-safe, so calls on it are serialized
+_tess_api = None
+_tess_unavailable = False
+_tess_lock = threading.Lock()
+
+
+def _get_tess_api():
+    """The worker's tesserocr engine, or None to use pytesseract. Hold _tess_lock."""
+    global _tess_api, _tess_unavailable
+    if _tess_api is None and not _tess_unavailable:
+        # Optional: tesserocr binds libtesseract directly, so one loaded
+        # engine is reused instead of starting a tesseract process per image
+        try:
+            import tesserocr
+
+            _tess_api = tesserocr.PyTessBaseAPI(psm=tesserocr.PSM.AUTO)
+        except ImportError:
+            _tess_unavailable = True
+        except RuntimeError as e:
+            # e.g. no traineddata found; use the tesseract binary instead
+            print(f"[OCR] tesserocr unavailable ({e}); falling back to pytesseract")
+            _tess_unavailable = True
+    return _tess_api
+
+
+def _ocr_image(image: "Image.Image") -> str:
+    """OCR one image, through the worker's tesserocr engine when available."""
+    with _tess_lock:
+        api = _get_tess_api()
+        if api is not None:
+            api.SetImage(image)
+            return api.GetUTF8Text() or ""
+    return _pytesseract().image_to_string(image) or ""
+
+
+# Preprocessing for photographed / scanned images. Tesseract binarizes with
+# a global (Otsu) threshold, which copes with clean scans, so an image is
+# only changed when that threshold is likely to fail:
+# - low contrast (gray levels, ignoring the OCR_CONTRAST_CUTOFF percent
+#   darkest and lightest pixels, span less than OCR_LOW_CONTRAST) gets its
+#   contrast stretched;
+# - uneven lighting (the paper brightness, estimated on a thumbnail with the
+#   text filtered out, varies by more than OCR_UNEVEN_SPREAD levels) gets an
+#   adaptive threshold: a pixel turns black when it is more than
+#   OCR_THRESHOLD_OFFSET levels darker than its Gaussian-weighted
+#   neighbourhood. The blur radius scales with the image (at least
+#   OCR_THRESHOLD_RADIUS px), so thick strokes are not hollowed out.
+# Images with a dark background anywhere (banners, inverted text) are left
+# alone: local thresholding whitens large dark areas and the text on them.
+OCR_LOW_CONTRAST = 96
+OCR_CONTRAST_CUTOFF = 0.1
+OCR_UNEVEN_SPREAD = 48
+OCR_DARK_BACKGROUND = 96
+OCR_THRESHOLD_RADIUS = 5
+OCR_THRESHOLD_RADIUS_DIVISOR = 32
+OCR_THRESHOLD_OFFSET = 10
+OCR_ANALYSIS_SIZE = 256
+
+
+def _percentile(histogram: List[int], fraction: float) -> int:
+    """Gray level below which ``fraction`` of a 256-bin histogram's pixels lie."""
+    target = fraction * sum(histogram)
+    seen = 0
+    for level, count in enumerate(histogram):
+        seen += count
+        if seen >= target:
+            return level
+    return 255
+
+
+def _preprocess_for_ocr(image: "Image.Image") -> "Image.Image":
+    """Stretch contrast or adaptively binarize an image when plain OCR would struggle."""
+    from PIL import ImageChops, ImageFilter, ImageOps
+
+    gray = image if image.mode == "L" else image.convert("L")
+
+    small = gray.copy()
+    small.thumbnail((OCR_ANALYSIS_SIZE, OCR_ANALYSIS_SIZE))
+    # A max filter wider than a text stroke leaves only the background
+    window = max(3, min(small.size) // 16) | 1
+    background_min, background_max = small.filter(ImageFilter.MaxFilter(window)).getextrema()
+    if background_min < OCR_DARK_BACKGROUND:
+        return image
+    if background_max - background_min > OCR_UNEVEN_SPREAD:
+        radius = max(OCR_THRESHOLD_RADIUS, min(gray.size) // OCR_THRESHOLD_RADIUS_DIVISOR)
+        gray = ImageOps.autocontrast(gray)
+        local_mean = gray.filter(ImageFilter.GaussianBlur(radius))
+        # How much darker each pixel is than its surroundings (clipped at 0)
+        darkness = ImageChops.subtract(local_mean, gray)
+        # point() applies a 256-entry lookup table in C, not a Python per-pixel loop
+        return darkness.point(lambda v: 0 if v > OCR_THRESHOLD_OFFSET else 255)
+
+    histogram = gray.histogram()
+    fraction = OCR_CONTRAST_CUTOFF / 100
+    if _percentile(histogram, 1 - fraction) - _percentile(histogram, fraction) < OCR_LOW_CONTRAST:
+        return ImageOps.autocontrast(gray, cutoff=OCR_CONTRAST_CUTOFF)
+    return image
+
+
+# Images per tesseract list-file run; longer lists can hang pytesseract
+OCR_BATCH_MAX = 50
+
+
+def _ocr_images_batch(paths: List[str]) -> List[str]:
+    """OCR several image files, returning one text per path in order.
+
+    Without tesserocr, each run of up to OCR_BATCH_MAX images is a single
+    tesseract invocation over a list file, so the engine starts once per
+    run instead of once per image.
+    """
+    from PIL import Image
+
+    with _tess_lock:
+        use_tesserocr = _get_tess_api() is not None
+    if use_tesserocr:
+        return [_ocr_image(Image.open(path)) for path in paths]
+
+    pytesseract = _pytesseract()
+    texts: List[str] = []
+    for start in range(0, len(paths), OCR_BATCH_MAX):
+        chunk = paths[start:start + OCR_BATCH_MAX]
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False, encoding="utf-8") as listfile:
+            listfile.write("\n".join(os.path.abspath(path) for path in chunk) + "\n")
+        try:
+            output = pytesseract.image_to_string(listfile.name) or ""
+        finally:
+            os.remove(listfile.name)
+
+        # Tesseract ends every page's text with a form feed
+        pages = output.split("\x0c")
+        if len(pages) < len(chunk):
+            # Page boundaries lost; OCR this run one image at a time
+            pages = [pytesseract.image_to_string(Image.open(path)) or "" for path in chunk]
+        texts.extend(pages[:len(chunk)])
+    return texts
+
+
+# Resolution scanned PDF pages are rendered at for OCR
+PDF_OCR_DPI = 300
+
+
+def _ocr_pdf_pages(doc: "pymupdf.Document", page_nums: List[int]) -> List[str]:
+    """OCR rendered PDF pages (1-based page numbers), one text per page in order."""
+    import pymupdf
+
+    with _tess_lock:
+        api = _get_tess_api()
+        if api is not None:
+            texts: List[str] = []
+            for num in page_nums:
+                pix = doc[num - 1].get_pixmap(dpi=PDF_OCR_DPI, colorspace=pymupdf.csGRAY)
+                # Raw pixels straight into Tesseract: no PNG encode / decode
+                api.SetImageBytes(pix.samples, pix.width, pix.height, pix.n, pix.stride)
+                # Raw bytes carry no DPI; without it Tesseract assumes 70
+                api.SetSourceResolution(PDF_OCR_DPI)
+                texts.append(api.GetUTF8Text() or "")
+            return texts
+
+    # pytesseract reads files anyway, so render to PNGs and OCR them in one run
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths: List[str] = []
+        for num in page_nums:
+            path = os.path.join(tmp_dir, f"page-{num}.png")
+            doc[num - 1].get_pixmap(dpi=PDF_OCR_DPI, colorspace=pymupdf.csGRAY).save(path)
+            paths.append(path)
+        return _ocr_images_batch(paths)
+
+
+# ---------- EXTRACTION CACHE ----------
+
+# Extracted doc_info per file content, shared by all ingestion workers
+# (they are separate processes, so the cache lives on disk). Bump the
+# version whenever extraction output changes to ignore older entries.
+EXTRACTION_CACHE_DIR = os.path.join(os.path.dirname(__file__), "..", ".ocr_cache")
+EXTRACTION_CACHE_VERSION = 5
+
+# Entries hold the full extracted text, PII included, so retention is
+# bounded: they expire EXTRACTION_CACHE_TTL seconds after being written
+# (REGDOC_EXTRACTION_CACHE_TTL=0 disables the cache), and the oldest are
+# evicted once the directory exceeds EXTRACTION_CACHE_MAX_BYTES.
+EXTRACTION_CACHE_TTL = int(os.environ.get("REGDOC_EXTRACTION_CACHE_TTL", 24 * 60 * 60))
+EXTRACTION_CACHE_MAX_BYTES = 256 << 20  # 256 MiB
+
+
+def _file_sha256(path: str) -> str:
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            # mmap can't map an empty file
+            return hashlib.sha256().hexdigest()
+        # Hash the page-cache mapping directly: no read buffers
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return hashlib.sha256(mapped).hexdigest()
+
+
+def _cached_extraction(
+    path: str, kind: str, extract: Callable[[], Tuple[Dict[str, Any], bool]]
+) -> Dict[str, Any]:
+    """Return extract()'s result for this file's bytes, from disk when seen before.
+
+    ``extract`` returns ``(doc_info, complete)``; an incomplete result (OCR
+    was needed but unavailable) is returned without being cached, so it is
+    redone once OCR works.
+    """
+    if EXTRACTION_CACHE_TTL <= 0:
+        return extract()[0]
+
+    key = f"{_file_sha256(path)}-{kind}-v{EXTRACTION_CACHE_VERSION}"
+    cache_dir = os.path.abspath(EXTRACTION_CACHE_DIR)
+    cache_path = os.path.join(cache_dir, key + ".json")
+    try:
+        with open(cache_path, "rb") as f:
+            if time.time() - os.fstat(f.fileno()).st_mtime <= EXTRACTION_CACHE_TTL:
+                return orjson.loads(f.read())
+    except (OSError, orjson.JSONDecodeError):
+        pass
+
+    info, complete = extract()
+    if not complete:
+        return info
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        # Write then rename, so a concurrent reader never sees half a file;
+        # owner-only permissions, as entries contain document text
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(fd, "wb") as f:
+            f.write(orjson.dumps(info))
+        os.replace(tmp_path, cache_path)
+        _prune_extraction_cache(cache_dir)
+    except OSError:
+        # Caching is best effort; a read-only checkout still works
+        pass
+    return info
+
+
+def _prune_extraction_cache(cache_dir: str) -> None:
+    """Delete expired entries, then the oldest until under the size cap."""
+    now = time.time()
+    entries: List[Tuple[float, int, str]] = []
+    total_bytes = 0
+    for entry in os.scandir(cache_dir):
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        if now - stat.st_mtime > EXTRACTION_CACHE_TTL:
+            _remove_quietly(entry.path)
+        elif entry.name.endswith(".json"):
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total_bytes += stat.st_size
+
+    for _, size, entry_path in sorted(entries):
+        if total_bytes <= EXTRACTION_CACHE_MAX_BYTES:
             break
+        _remove_quietly(entry_path)
+        total_bytes -= size
+
 
-if _tess_cmd:
-    pytesseract.pytesseract.tesseract_cmd = _tess_cmd
-    print(f"[OCR] Using Tesseract at: {_tess_cmd}")
-else:
-    # We won't crash here; _process_image will handle the missing binary
-    print("[OCR] WARNING: tesseract.exe not found. Image OCR will be unavailable.")
+def _remove_quietly(path: str) -> None:
+    # Another worker may have removed it first
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+# Tunable threshold; small to avoid false negatives on short docs
+LEGIBLE_MIN_CHARS = 30
 
 
 def _assess_legibility(texts: List[str]) -> bool:
@@ -37,14 +326,81 @@ def _assess_legibility(texts: List[str]) -> bool:
     we mark the document as legible. Otherwise we ask the user to check manually.
     """
     total_chars = sum(len((t or "").strip()) for t in texts)
-    # Tunable threshold; small to avoid false negatives on short docs
-    return total_chars >= 30
+    return total_chars >= LEGIBLE_MIN_CHARS
+
+
+def _has_legible_text_layer(doc: "pymupdf.Document") -> bool:
+    """_assess_legibility over the whole document, stopping once it's met."""
+    total_chars = 0
+    for page in doc:
+        total_chars += len((page.get_text("text") or "").strip())
+        if total_chars >= LEGIBLE_MIN_CHARS:
+            return True
+    return False
+
 
+# PDFs longer than this are split into page ranges that separate ingestion
+# workers extract at the same time (PyMuPDF is not thread-safe, so the split
+# is across processes, each with its own document handle).
+PDF_SHARD_PAGES = 32
 
-def _process_pdf(file_bytes: bytes) -> Dict[str, Any]:
-    """Extract text & image counts from a PDF file.
 
-    Returns a normalized doc_info dict without the filename (added later):
+# (start, stop, ocr): pages [start, stop) (0-based), and whether the whole
+# document lacks a legible text layer so its blank pages need OCR
+PageRange = Tuple[int, int, bool]
+
+
+def pdf_page_ranges(path: str, filename: str) -> List[Optional[PageRange]]:
+    """Split a PDF into page ranges of PDF_SHARD_PAGES pages.
+
+    The OCR decision is made here, for the whole document, so a shard
+    boundary never changes which pages get OCR'd. Returns ``[None]`` (ingest
+    the whole file as one task) for non-PDFs, short PDFs, and files that
+    can't be opened here, so the worker reports the error.
+    """
+    if os.path.splitext(filename)[1].lower() != ".pdf":
+        return [None]
+    import pymupdf
+
+    try:
+        with pymupdf.open(path) as doc:
+            page_count = doc.page_count
+            if page_count <= PDF_SHARD_PAGES:
+                return [None]
+            ocr = not _has_legible_text_layer(doc)
+    except Exception:
+        return [None]
+    return [
+        (start, min(start + PDF_SHARD_PAGES, page_count), ocr)
+        for start in range(0, page_count, PDF_SHARD_PAGES)
+    ]
+
+
+def merge_page_ranges(parts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Combine the doc_info dicts of one PDF's page ranges, in page order."""
+    parts = sorted(parts, key=lambda part: part["pages"][0]["page_num"] if part["pages"] else 0)
+    pages = [page for part in parts for page in part["pages"]]
+    return {
+        "num_pages": len(pages),
+        "num_images": sum(part["num_images"] for part in parts),
+        "legible": _assess_legibility([page["text"] for page in pages]),
+        "pages": pages,
+        "filename": parts[0]["filename"],
+    }
+
+
+def _process_pdf(
+    path: str, page_range: Optional[PageRange] = None
+) -> Tuple[Dict[str, Any], bool]:
+    """Extract text & image counts from a PDF file on disk.
+
+    ``page_range`` (from pdf_page_ranges) limits extraction to its pages;
+    page numbers in the result stay relative to the whole document. Scanned
+    PDFs (no legible text layer in the whole document) have their blank
+    pages OCR'd; ``complete`` is False when that OCR failed.
+
+    Returns ``(doc_info, complete)``, with a normalized doc_info dict
+    without the filename (added later):
         {
             "num_pages": int,
             "num_images": int,
@@ -55,17 +411,21 @@ def _process_pdf(file_bytes: bytes) -> Dict[str, Any]:
             ],
         }
     """
+    import pymupdf
+
     pages: List[Dict[str, Any]] = []
-    page_texts: List[str] = []
     num_images = 0
 
-    with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
-        for i, page in enumerate(pdf.pages, start=1):
-            text = page.extract_text() or ""
-            page_texts.append(text)
+    complete = True
+    doc = pymupdf.open(path)
+    try:
+        start, stop, ocr = page_range or (0, doc.page_count, None)
+        for i in range(start + 1, stop + 1):
+            page = doc[i - 1]
+            text = page.get_text("text") or ""
 
-            # pdfplumber exposes image metadata per page
-            num_images += len(page.images)
+            # Images referenced by this page (xref list, no pixel decoding)
+            num_images += len(page.get_images(full=False))
 
             pages.append(
                 {
@@ -74,18 +434,36 @@ def _process_pdf(file_bytes: bytes) -> Dict[str, Any]:
                 }
             )
 
+        if ocr is None:
+            # Whole document in hand: decide from its own text
+            ocr = not _assess_legibility([p["text"] for p in pages])
+        blank = [p for p in pages if not p["text"].strip()] if ocr else []
+        if blank:
+            try:
+                ocr_texts = _ocr_pdf_pages(doc, [p["page_num"] for p in blank])
+            except (_pytesseract().TesseractError, OSError, RuntimeError) as e:
+                # No OCR available: keep the (empty) text layer for now
+                print(f"[OCR] Could not OCR scanned PDF pages: {e}")
+                complete = False
+            else:
+                for p, ocr_text in zip(blank, ocr_texts):
+                    p["text"] = ocr_text
+    finally:
+        doc.close()
+
     num_pages = len(pages)
-    legible = _assess_legibility(page_texts)
+    legible = _assess_legibility([p["text"] for p in pages])
 
-    return {
+    info = {
         "num_pages": num_pages,
         "num_images": num_images,
         "legible": legible,
         "pages": pages,
     }
+    return info, complete
 
 
-def _process_image(file_bytes: bytes) -> Dict[str, Any]:
+def _process_image(path: str) -> Dict[str, Any]:
     """Handle standalone image files (PNG / JPG / JPEG).
 
     We treat each uploaded image as a single-page document with:
@@ -93,10 +471,12 @@ def _process_image(file_bytes: bytes) -> Dict[str, Any]:
         - num_images = 1
         - OCR text extracted via Tesseract
     """
-    image = Image.open(io.BytesIO(file_bytes)).convert("RGB")
+    from PIL import Image
+
+    image = _preprocess_for_ocr(Image.open(path))
 
     # OCR using Tesseract
-    ocr_text = pytesseract.image_to_string(image) or ""
+    ocr_text = _ocr_image(image)
 
     pages = [
         {
@@ -115,24 +495,31 @@ def _process_image(file_bytes: bytes) -> Dict[str, Any]:
     }
 
 
-def process_file(uploaded_file) -> Dict[str, Any]:
-    """Accepts a Streamlit UploadedFile and returns a normalized doc_info dict.
+def process_file(
+    path: str, filename: str, page_range: Optional[PageRange] = None
+) -> Dict[str, Any]:
+    """Accepts an uploaded file spooled to disk and returns a normalized doc_info dict.
 
-    This is the single entrypoint used by the Streamlit app. It supports:
+    This is the single entrypoint used by the Streamlit app. ``path`` is the
+    on-disk copy of the upload and ``filename`` its original name (used for
+    type detection and reporting). It supports:
       - PDFs (multi-page, text + embedded images)
       - Standalone images (PNG / JPG / JPEG) via OCR
+
+    ``page_range`` (from pdf_page_ranges) extracts only part of a PDF; the
+    parts are put back together with merge_page_ranges.
     """
-    file_bytes = uploaded_file.read()
-    name = uploaded_file.name.lower()
+    ext = os.path.splitext(filename)[1].lower()
 
-    if name.endswith(".pdf"):
-        info = _process_pdf(file_bytes)
-    elif any(name.endswith(ext) for ext in (".png", ".jpg", ".jpeg")):
-        info = _process_image(file_bytes)
+    if ext == ".pdf":
+        kind = "pdf-{}-{}-{}".format(*page_range) if page_range else "pdf"
+        info = _cached_extraction(path, kind, lambda: _process_pdf(path, page_range))
+    elif ext in (".png", ".jpg", ".jpeg"):
+        info = _cached_extraction(path, "image", lambda: (_process_image(path), True))
     else:
         # Fallback: try image path first, then treat as zero-page doc
         try:
-            info = _process_image(file_bytes)
+            info = _process_image(path)
         except Exception:
             info = {
                 "num_pages": 0,
@@ -141,5 +528,5 @@ def process_file(uploaded_file) -> Dict[str, Any]:
                 "pages": [],
             }
 
-    info["filename"] = uploaded_file.name
+    info["filename"] = filename
     return info
@@ -1,17 +1,165 @@
 # backend/llm_client.py
+import hashlib
+import logging
 import os
+import threading
+from functools import lru_cache
 import requests
+from requests.adapters import HTTPAdapter
 from typing import Any, Dict, Optional
-import json
+import orjson
 import streamlit as st
 
 from dotenv import load_dotenv
+from urllib3.util.retry import Retry
+
+# Optional shared response cache (see get_response_cache)
+try:
+    import redis
+except ImportError:
+    redis = None
 
 # Load environment variables from .env at project root
 load_dotenv()
 
 OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
 
+# How much of a response body goes into log messages
+RESPONSE_PREVIEW_BYTES = 512
+
+logger = logging.getLogger(__name__)
+
+# Read once at import rather than on every call: the environment (and .env)
+# first for local runs, then Streamlit secrets for deployments
+OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")  # ADD YOUR OWN API KEY
+if not OPENROUTER_API_KEY:
+    try:
+        OPENROUTER_API_KEY = st.secrets.get("OPENROUTER_API_KEY")
+    except Exception:
+        # No secrets.toml (or not running under Streamlit)
+        OPENROUTER_API_KEY = None
+
+_REQUEST_HEADERS: Optional[Dict[str, str]] = (
+    {
+        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+        "Content-Type": "application/json",
+    }
+    if OPENROUTER_API_KEY
+    else None
+)
+
+# Upper bound on in-flight OpenRouter requests across all worker threads.
+# The app fans documents out to many threads; this keeps the LLM calls
+# themselves at a level the API tolerates without queuing per document.
+MAX_CONCURRENT_REQUESTS = 8
+_REQUEST_SLOTS = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+
+# Transient OpenRouter failures (rate limits, gateway errors) are retried
+# with exponential backoff, honouring Retry-After. POST is included because
+# a chat completion has no side effects worth guarding against.
+RETRY_POLICY = Retry(
+    total=3,
+    backoff_factor=0.5,
+    status_forcelist=[429, 500, 502, 503, 504],
+    allowed_methods=["POST"],
+    raise_on_status=False,
+)
+
+
+@lru_cache(maxsize=1)
+def get_http_session() -> requests.Session:
+    """Process-wide session so OpenRouter connections are kept alive and reused.
+
+    Streamlit re-runs app.py on every interaction but keeps imported modules,
+    so this survives reruns and is shared by all worker threads. The pool
+    holds more connections than MAX_CONCURRENT_REQUESTS, so no request
+    ever waits for, or discards, a connection.
+    """
+    session = requests.Session()
+    session.mount(
+        "https://",
+        HTTPAdapter(pool_connections=8, pool_maxsize=16, max_retries=RETRY_POLICY),
+    )
+    return session
+
+
+def get_request_headers() -> Dict[str, str]:
+    """OpenRouter request headers, precomputed at import."""
+    if _REQUEST_HEADERS is None:
+        # Fail early with a clear message instead of 401 later
+        raise RuntimeError(
+            "OPENROUTER_API_KEY is not set. "
+            "Create a .env file with OPENROUTER_API_KEY=... in the project root."
+        )
+    return _REQUEST_HEADERS
+
+
+# Deterministic (temperature 0) completions are memoized: the newest
+# LLM_CACHE_SIZE in-process, and for LLM_CACHE_TTL seconds in Redis when
+# REGDOC_REDIS_URL is set, so every app instance shares the hits.
+LLM_CACHE_SIZE = 512
+LLM_CACHE_TTL = 24 * 60 * 60
+REDIS_URL = os.getenv("REGDOC_REDIS_URL")
+
+
+@lru_cache(maxsize=1)
+def get_response_cache() -> Optional["redis.Redis"]:
+    """Redis client for the shared response cache, or None when not configured."""
+    if redis is None or not REDIS_URL:
+        return None
+    return redis.Redis.from_url(REDIS_URL)
+
+
+def _is_usable_content(content: bytes, response_format_json: bool) -> bool:
+    """Whether cached content can be returned (JSON replies must parse)."""
+    if not response_format_json:
+        return True
+    try:
+        orjson.loads(content)
+    except orjson.JSONDecodeError:
+        return False
+    return True
+
+
+@lru_cache(maxsize=LLM_CACHE_SIZE)
+def _cached_completion(
+    model: str,
+    system_prompt: str,
+    user_prompt: str,
+    response_format_json: bool,
+) -> str:
+    """Message content of a temperature-0 completion, fetched at most once.
+
+    With ``response_format_json`` only content that parses is stored: a
+    malformed reply raises here, before Redis or the lru_cache keep it, so
+    a retry asks the model again.
+    """
+    cache = get_response_cache()
+    key = "llm:" + hashlib.sha256(
+        orjson.dumps([model, system_prompt, user_prompt, response_format_json])
+    ).hexdigest()
+
+    if cache is not None:
+        try:
+            hit = cache.get(key)
+        except redis.RedisError:
+            # The shared cache is an optimisation; never fail a call over it
+            hit = None
+        if hit is not None and _is_usable_content(hit, response_format_json):
+            return hit.decode("utf-8")
+
+    content = _request_completion(model, system_prompt, user_prompt, response_format_json, 0.0)
+    if response_format_json:
+        # Raises orjson.JSONDecodeError (a ValueError) on a malformed reply
+        orjson.loads(content)
+
+    if cache is not None:
+        try:
+            cache.setex(key, LLM_CACHE_TTL, content)
+        except redis.RedisError:
+            pass
+    return content
+
 
 def call_openrouter_chat(
     model: str,
@@ -23,28 +171,32 @@ def call_openrouter_chat(
     """
     Thin wrapper around OpenRouter chat/completions.
     Returns either parsed JSON (if response_format_json=True) or raw string.
+
+    Calls with temperature 0 are deterministic and served from the response
+    cache when the same model and prompts were seen before.
     """
+    if temperature == 0:
+        content = _cached_completion(model, system_prompt, user_prompt, response_format_json)
+    else:
+        content = _request_completion(model, system_prompt, user_prompt, response_format_json, temperature)
 
-    
-    # 🔍 DEBUG: see exactly what we got from the environment
-    api_key = st.secrets["OPENROUTER_API_KEY"] #ADD YOUR OWN API KEY
-    print("[DEBUG] OPENROUTER_API_KEY from env:",(api_key))
+    if response_format_json:
+        # The model is instructed to return JSON only
+        return orjson.loads(content)
 
-    if not api_key:
-        # Fail early with a clear message instead of 401 later
-        raise RuntimeError(
-            "OPENROUTER_API_KEY is not set. "
-            "Create a .env file with OPENROUTER_API_KEY=... in the project root."
-        )
+    return {"raw": content}
 
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-    }
 
-    # 🔍 DEBUG: check what we’re actually sending in the header (masked)
-    print("[DEBUG] Auth header prefix:", headers["Authorization"][:25])
-    print("[DEBUG] Using model:", model)
+def _request_completion(
+    model: str,
+    system_prompt: str,
+    user_prompt: str,
+    response_format_json: bool,
+    temperature: float,
+) -> str:
+    """POST one chat completion and return the message content."""
+    headers = get_request_headers()
+    logger.debug("Using model: %s", model)
 
     payload: Dict[str, Any] = {
         "model": model,
@@ -58,24 +210,30 @@ def call_openrouter_chat(
     if response_format_json:
         payload["response_format"] = {"type": "json_object"}
 
-    resp = requests.post(OPENROUTER_URL, headers=headers, json=payload, timeout=60)
+    with _REQUEST_SLOTS:
+        resp = get_http_session().post(OPENROUTER_URL, headers=headers, data=orjson.dumps(payload), timeout=60)
 
-    # 🔍 DEBUG: log status + first part of body before raising
-    print("[DEBUG] OpenRouter status:", resp.status_code)
-    print("[DEBUG] OpenRouter raw response (start):", resp.text[:300])
+    logger.debug("OpenRouter status: %s", resp.status_code)
 
+    # Error bodies and debug previews decode only a bounded prefix of the
+    # response, never the whole body
     try:
         resp.raise_for_status()
     except requests.HTTPError as e:
-        # Print server message to your terminal for easier debugging
-        print("[OpenRouter ERROR]", resp.status_code, resp.text)
+        # Log the server message for easier debugging
+        logger.error(
+            "OpenRouter error %s: %s",
+            resp.status_code,
+            resp.content[:RESPONSE_PREVIEW_BYTES].decode("utf-8", "replace"),
+        )
         raise
 
-    data = resp.json()
-    content = data["choices"][0]["message"]["content"]
-
-    if response_format_json:
-        # The model is instructed to return JSON only
-        return json.loads(content)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "OpenRouter raw response (start): %s",
+            resp.content[:RESPONSE_PREVIEW_BYTES].decode("utf-8", "replace"),
+        )
 
-    return {"raw": content}
+    # Parse the raw bytes: no str decode of the body first
+    data = orjson.loads(resp.content)
+    return data["choices"][0]["message"]["content"]
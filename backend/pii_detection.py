@@ -1,6 +1,7 @@
 # backend/pii_detection.py
 
-import re
+import re as stdlib_re
+import unicodedata
 from typing import List, Dict, Any
 
 """
@@ -10,6 +11,30 @@ Detects personally identifiable information (PII) across document pages.
 Adds contextual tags to separate personal vs. business contact info.
 """
 
+# RE2 matches in linear time, so dense digit runs in OCR output (tables,
+# scanned invoices) can't make the card / phone patterns backtrack. All
+# patterns below stay within the syntax both engines accept.
+try:
+    import re2 as re
+except ImportError:
+    import re
+
+# RE2's \s and \d are ASCII-only, unlike stdlib re's. Pages are normalized
+# first so both engines see the same text: PyMuPDF keeps non-breaking and
+# other Unicode spaces ("555\xa0123\xa04567"), and OCR can emit non-ASCII
+# digits.
+_UNICODE_SPACE = stdlib_re.compile(r"[^\S \t\n\r\f]")
+_UNICODE_DIGIT = stdlib_re.compile(r"(?![0-9])\d")
+
+
+def normalize_text(text: str) -> str:
+    """Map Unicode whitespace to " " and Unicode decimal digits to ASCII."""
+    text = _UNICODE_SPACE.sub(" ", text)
+    if not text.isascii():
+        text = _UNICODE_DIGIT.sub(lambda m: str(unicodedata.digit(m.group())), text)
+    return text
+
+
 # === Regular Expressions for Common PII ===
 
 EMAIL_PATTERN = re.compile(
@@ -17,7 +42,7 @@ EMAIL_PATTERN = re.compile(
 )
 
 PHONE_PATTERN = re.compile(
-    r"(\+?\d{1,2}\s?)?(\(?\d{3}\)?[\s.-]?\d{3}[\s.-]?\d{4})"
+    r"(?:\+?\d{1,2}\s?)?(?:\(?\d{3}\)?[\s.-]?\d{3}[\s.-]?\d{4})"
 )
 
 SSN_PATTERN = re.compile(
@@ -29,56 +54,52 @@ CREDIT_CARD_PATTERN = re.compile(
 )
 
 ADDRESS_PATTERN = re.compile(
-    r"\b\d{1,5}\s+[A-Za-z0-9.\s]+\s+(Street|St|Road|Rd|Avenue|Ave|Boulevard|Blvd|Lane|Ln|Drive|Dr|Way|Court|Ct|Place|Pl)\b",
-    re.IGNORECASE,
+    r"(?i:\b\d{1,5}\s+[A-Za-z0-9.\s]+\s+(?:Street|St|Road|Rd|Avenue|Ave|Boulevard|Blvd|Lane|Ln|Drive|Dr|Way|Court|Ct|Place|Pl)\b)"
 )
 
+# Each type is scanned with its own pattern. A single alternation would let
+# the leftmost match win: the card pattern starts at any digit run, so it
+# would swallow an SSN that follows a date or ID ("id 1234 123-45-6789").
+# Every type but email needs a digit, and email needs an "@", so a page
+# lacking one of the two only has to be scanned for the other kind.
+DIGIT_PII_PATTERNS = [
+    ("phone", PHONE_PATTERN),
+    ("ssn", SSN_PATTERN),
+    ("credit_card", CREDIT_CARD_PATTERN),
+    ("address", ADDRESS_PATTERN),
+]
+DIGIT_PATTERN = re.compile(r"\d")
+
 
 # === Helper: detect business vs. personal emails ===
 
+# Local parts starting with one of these are shared, public-facing inboxes
+BUSINESS_EMAIL_PATTERN = re.compile(
+    r"(?i:info|contact|support|sales|help|team|hello|admin|office|service)"
+)
+
+
 def is_business_email(email: str) -> bool:
     """Heuristically identify non-personal, public-facing email addresses."""
-    email = email.lower().strip()
-    local_part = email.split("@")[0]
-    return any(
-        local_part.startswith(prefix)
-        for prefix in [
-            "info",
-            "contact",
-            "support",
-            "sales",
-            "help",
-            "team",
-            "hello",
-            "admin",
-            "office",
-            "service",
-        ]
-    )
+    local_part = email.strip().split("@", 1)[0]
+    return BUSINESS_EMAIL_PATTERN.match(local_part) is not None
 
 
 # === Main Detection Function ===
 
-def find_pii(pages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    """
-    Scans all pages and returns structured PII findings.
-
-    Each finding: {
-        "type": "email" | "phone" | "ssn" | "credit_card" | "address",
-        "value": "...",
-        "page": int,
-        "is_business": bool   # only for emails
-    }
-    """
+def find_pii_in_text(text: str, page_num: int) -> List[Dict[str, Any]]:
+    """Scan a single page's text; same finding shape as find_pii."""
 
     results: List[Dict[str, Any]] = []
+    text = normalize_text((text or "").strip())
 
-    for page in pages:
-        page_num = page.get("page_num", -1)
-        text = (page.get("text") or "").strip()
+    # Substring / single-class searches run in C and stop at the first hit
+    has_at = "@" in text
+    has_digit = DIGIT_PATTERN.search(text) is not None
 
-        # === Email ===
-        for email in EMAIL_PATTERN.findall(text):
+    if has_at:
+        for match in EMAIL_PATTERN.finditer(text):
+            email = match.group(0)
             results.append({
                 "type": "email",
                 "value": email,
@@ -86,42 +107,33 @@ def find_pii(pages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
                 "is_business": is_business_email(email)
             })
 
-        # === Phone ===
-        for phone in PHONE_PATTERN.findall(text):
-            # phone is a tuple due to capture groups; join into string
-            clean_phone = " ".join([p for p in phone if p]).strip()
-            results.append({
-                "type": "phone",
-                "value": clean_phone,
-                "page": page_num
-            })
-
-        # === SSN ===
-        for ssn in SSN_PATTERN.findall(text):
-            results.append({
-                "type": "ssn",
-                "value": ssn,
-                "page": page_num
-            })
-
-        # === Credit Card ===
-        for cc in CREDIT_CARD_PATTERN.findall(text):
-            results.append({
-                "type": "credit_card",
-                "value": cc.strip(),
-                "page": page_num
-            })
-
-        # === Address ===
-        for addr in ADDRESS_PATTERN.findall(text):
-            # Since we used capture groups, re-run search to extract full match
-            for match in re.finditer(ADDRESS_PATTERN, text):
+    if has_digit:
+        for kind, pattern in DIGIT_PII_PATTERNS:
+            for match in pattern.finditer(text):
                 results.append({
-                    "type": "address",
-                    "value": match.group(0),
+                    "type": kind,
+                    "value": match.group(0).strip(),
                     "page": page_num
                 })
-            break  # avoid duplicate address per page
 
     return results
 
+
+def find_pii(pages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Scans all pages and returns structured PII findings.
+
+    Each finding: {
+        "type": "email" | "phone" | "ssn" | "credit_card" | "address",
+        "value": "...",
+        "page": int,
+        "is_business": bool   # only for emails
+    }
+    """
+
+    results: List[Dict[str, Any]] = []
+
+    for page in pages:
+        results.extend(find_pii_in_text(page.get("text") or "", page.get("page_num", -1)))
+
+    return results
@@ -0,0 +1,56 @@
+# backend/scan.py
+
+from typing import Any, Dict, List, Tuple
+
+from .pii_detection import find_pii_in_text
+from .safety import PROFANITY_WORDS, UNSAFE_KEYWORDS
+
+"""
+Single-pass heuristic scanner for RegDoc Classifier
+---------------------------------------------------
+Replaces separate find_pii / naive_unsafe_check / profanity_pages passes
+with one walk over the document: every page is lower-cased once and
+scanned for PII and profanity, and the unsafe phrases are checked on the
+joined document text.
+"""
+
+# Keyword checks are plain `kw in text` substring tests: CPython's
+# substring search is fast enough that with keyword lists this short it
+# beats a compiled alternation over the same text.
+_UNSAFE_KEYWORDS = tuple(dict.fromkeys(UNSAFE_KEYWORDS))
+_PROFANITY_WORDS = tuple(dict.fromkeys(PROFANITY_WORDS))
+
+
+def scan_pages(pages: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], bool, List[int]]:
+    """
+    Scan all pages once and return (pii_findings, unsafe_flag, profanity_pages).
+
+    Results match find_pii, naive_unsafe_check and profanity_pages: unsafe
+    phrases are matched on the space-joined document text (so a phrase that
+    straddles a page break still counts), profanity per page.
+    """
+    return scan_documents([pages])[0]
+
+
+def scan_documents(
+    documents: List[List[Dict[str, Any]]]
+) -> List[Tuple[List[Dict[str, Any]], bool, List[int]]]:
+    """scan_pages for each of several documents."""
+    results: List[Tuple[List[Dict[str, Any]], bool, List[int]]] = []
+    for pages in documents:
+        pii: List[Dict[str, Any]] = []
+        lowered: List[str] = []
+        prof_pages: List[int] = []
+        for page in pages:
+            text = page.get("text") or ""
+            pii.extend(find_pii_in_text(text, page.get("page_num", -1)))
+
+            low = text.lower()
+            lowered.append(low)
+            if any(word in low for word in _PROFANITY_WORDS):
+                prof_pages.append(page["page_num"])
+
+        doc_text = " ".join(lowered)
+        unsafe_flag = any(kw in doc_text for kw in _UNSAFE_KEYWORDS)
+        results.append((pii, unsafe_flag, prof_pages))
+    return results
@@ -4,21 +4,50 @@ import os
 from datetime import datetime
 from typing import Any, Dict, List
 
-# history.json in project root
-HISTORY_PATH = os.path.join(os.path.dirname(__file__), "..", "history.json")
+import orjson
+
+# history.jsonl in project root: one JSON object per line, append-only
+HISTORY_PATH = os.path.join(os.path.dirname(__file__), "..", "history.jsonl")
+
+# Pre-JSONL audit log (a single JSON array); converted on first use
+LEGACY_HISTORY_PATH = os.path.join(os.path.dirname(__file__), "..", "history.json")
+
+
+def migrate_legacy_history() -> None:
+    """Convert an old history.json array into history.jsonl, once."""
+    legacy = os.path.abspath(LEGACY_HISTORY_PATH)
+    path = os.path.abspath(HISTORY_PATH)
+    if os.path.exists(path) or not os.path.exists(legacy):
+        return
+    try:
+        with open(legacy, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+    except Exception:
+        # unreadable legacy file: leave it alone and start fresh
+        return
+    with open(path, "ab") as f:
+        for entry in entries:
+            f.write(orjson.dumps(entry) + b"\n")
+    os.remove(legacy)
 
 
 def load_history() -> List[Dict[str, Any]]:
     """Load the full audit trail from disk."""
+    migrate_legacy_history()
     path = os.path.abspath(HISTORY_PATH)
     if not os.path.exists(path):
         return []
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        # if file is corrupted, start fresh
-        return []
+    history: List[Dict[str, Any]] = []
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                history.append(orjson.loads(line))
+            except orjson.JSONDecodeError:
+                # skip a corrupted / partially written line
+                continue
+    return history
 
 
 def save_result(
@@ -29,7 +58,7 @@ def save_result(
     reviewer_comment: str = "",
 ) -> None:
     """Append a single classification + review entry to the audit log."""
-    history = load_history()
+    migrate_legacy_history()
 
     entry = {
         "filename": filename,
@@ -44,8 +73,7 @@ def save_result(
         "reviewer_comment": reviewer_comment,
     }
 
-    history.append(entry)
-
+    # A single write on an O_APPEND handle: no rewrite of earlier entries
     path = os.path.abspath(HISTORY_PATH)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(history, f, indent=2)
+    with open(path, "ab") as f:
+        f.write(orjson.dumps(entry) + b"\n")